@@ -1,6 +1,8 @@
 import datetime
+import math
 import os
 import logging
+import secrets
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +13,16 @@ load_dotenv(".env")
 BASE_URL = os.getenv("BASE_URL")
 
 from typing import Annotated
-from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse
+from fastapi.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from starsessions import CookieStore, SessionAutoloadMiddleware, SessionMiddleware
 from tortoise import Tortoise
 from rq import Queue
@@ -25,12 +33,29 @@ import validators
 # We need to initialize the models before defining marshalling classes
 Tortoise.init_models(["certainty.models"], "models")
 
-from fastapi import FastAPI, Request, Form, Response
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Form,
+    Response,
+)
 from tortoise.contrib.fastapi import register_tortoise
 
+from certainty.changes import (
+    ack_changes,
+    is_valid_change_id,
+    read_changes,
+    read_group_changes,
+    stream_changes,
+)
 from certainty.marshalling import (
     CertificateMonitorPostRequest,
     CertificateMonitorResponse,
+    ChangeAckRequest,
 )
 from certainty.models import CertificateMonitor, MagicLink
 from certainty.monitor import (
@@ -39,11 +64,15 @@ from certainty.monitor import (
     refresh_certificate_monitor,
     check_certificates_sync
 )
+from certainty.compaction import compact_sync
+from certainty.ratelimit import rate_limit
+from certainty.timeline import expiring_within, remove_monitor_timeline
 from certainty.email import send_magic_link, send_monitor_deleted  # Add this import at the top of the file
 
 
 app = FastAPI()
 redis_conn = Redis(host=os.getenv("REDIS_HOST"), port=6379)
+async_redis_conn = AsyncRedis(host=os.getenv("REDIS_HOST"), port=6379)
 q = Queue("certainty", connection=redis_conn)
 scheduler = Scheduler(
     "certainty", connection=redis_conn
@@ -67,6 +96,48 @@ register_tortoise(
 )
 
 
+def client_address(request: Request) -> str:
+    # nginx passes the real client address through, see nginx.conf
+    return request.headers.get("X-Real-IP", request.client.host)
+
+
+def enforce_rate_limit(**buckets: str) -> None:
+    if (retry_after := rate_limit(**buckets)) is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+def check_bearer_token(authorization: str, token_env: str, detail: str) -> None:
+    # Routes that cover every monitor are disabled unless their token is set
+    token = os.getenv(token_env)
+    # Compared as bytes, as compare_digest refuses non-ASCII strings. Starlette
+    # decodes headers as latin-1, so encoding them back can't fail.
+    if not token or not secrets.compare_digest(
+        authorization.encode("latin-1"), f"Bearer {token}".encode()
+    ):
+        raise HTTPException(status_code=401, detail=detail)
+
+
+def require_change_feed_token(authorization: Annotated[str, Header()] = "") -> None:
+    check_bearer_token(authorization, "CHANGE_FEED_TOKEN", "Invalid change feed token")
+
+
+def require_expiring_api_token(authorization: Annotated[str, Header()] = "") -> None:
+    check_bearer_token(
+        authorization, "EXPIRING_API_TOKEN", "Invalid expiring monitors token"
+    )
+
+
+def validate_change_ids(*change_ids: str | None) -> None:
+    # Redis rejects malformed ids with an error, which would otherwise be a 500
+    for change_id in change_ids:
+        if change_id is not None and not is_valid_change_id(change_id):
+            raise HTTPException(status_code=400, detail="Invalid change id")
+
+
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
     return templates.TemplateResponse(
@@ -93,6 +164,8 @@ async def create_monitor(
         error = "Please provide a valid email"
     elif validators.between(warning_days, min=1, max=365):
         error = "Please provide a valid number of warning days"
+    elif rate_limit(client=client_address(request), domain=domain) is not None:
+        error = "Too many requests, please try again later"
 
     if error:
         return templates.TemplateResponse(
@@ -208,15 +281,18 @@ async def refresh_monitor(request: Request, monitor_id: str):
     ):
         return RedirectResponse(url="/", status_code=303)
 
-    current_time = datetime.datetime.now(tz=datetime.timezone.utc)
     if (
-        monitor.checked_at is None
-        or (current_time - monitor.checked_at).total_seconds() > 5
+        rate_limit(
+            monitor=monitor_id,
+            client=client_address(request),
+            domain=monitor.domain,
+        )
+        is None
     ):
         monitor = await refresh_certificate_monitor(monitor_id)
     else:
         logger.info(
-            f"Skipping refresh for monitor {monitor_id} as it was recently checked"
+            f"Skipping refresh for monitor {monitor_id} as it was rate limited"
         )
 
     return RedirectResponse(url=f"/monitor/{monitor_id}", status_code=303)
@@ -235,6 +311,7 @@ async def delete_monitor(request: Request, monitor_id: str):
     email = monitor.email
     domain = monitor.domain
     await monitor.delete()
+    remove_monitor_timeline(monitor.uuid)
 
     # Enqueue the deletion confirmation email
     q.enqueue(send_monitor_deleted, email, domain)
@@ -282,12 +359,16 @@ async def management_post(email: Annotated[str, Form()], request: Request):
 async def management_magic_link_get(
     request: Request, magic_link: str, response: Response
 ):
-    ml = await MagicLink.get(token=magic_link)
-
-    if ml.used_at is None:
-        ml.used_at = datetime.datetime.now(tz=datetime.timezone.utc)
-        await ml.save(update_fields=["used_at"])
+    ml = await MagicLink.get_or_none(token=magic_link)
 
+    # Claim the link with a conditional update, so it can only ever be used once
+    if (
+        ml is not None
+        and not ml.is_expired()
+        and await MagicLink.filter(id=ml.id, used_at=None).update(
+            used_at=datetime.datetime.now(tz=datetime.timezone.utc)
+        )
+    ):
         request.session["email"] = ml.email
 
         return RedirectResponse(url="/management")
@@ -296,12 +377,19 @@ async def management_magic_link_get(
             request,
             "management.html",
             context={"error": "Invalid or expired magic link"},
-            status=403,
+            status_code=403,
         )
 
 
 @app.post("/api/monitors")
-async def monitor(certificate_monitor_request: CertificateMonitorPostRequest):
+async def monitor(
+    certificate_monitor_request: CertificateMonitorPostRequest, request: Request
+):
+    enforce_rate_limit(
+        client=client_address(request),
+        domain=certificate_monitor_request.domain.strip().lower(),
+    )
+
     certificate_monitor = await create_certificate_monitor(
         certificate_monitor_request.domain,
         certificate_monitor_request.email,
@@ -311,6 +399,17 @@ async def monitor(certificate_monitor_request: CertificateMonitorPostRequest):
     return await refresh_certificate_monitor(certificate_monitor.uuid)
 
 
+@app.get("/api/monitors/expiring", dependencies=[Depends(require_expiring_api_token)])
+async def get_expiring_monitors_api(
+    days: Annotated[int, Query(ge=0, le=3650)] = 30,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    offset: Annotated[int, Query(ge=0)] = 0,
+) -> list[CertificateMonitorResponse]:
+    monitor_ids = expiring_within(days, limit, offset)
+
+    return await CertificateMonitor.filter(uuid__in=monitor_ids).order_by("not_after")
+
+
 @app.get("/api/monitors/{monitor_id}")
 async def get_monitor_api(monitor_id: str) -> CertificateMonitorResponse:
     monitor = await get_certificate_monitor(monitor_id)
@@ -319,10 +418,67 @@ async def get_monitor_api(monitor_id: str) -> CertificateMonitorResponse:
 
 
 @app.get("/api/monitors/{monitor_id}/refresh")
-async def get_certificate_api(monitor_id: str) -> CertificateMonitorResponse:
+async def get_certificate_api(
+    monitor_id: str, request: Request
+) -> CertificateMonitorResponse:
+    monitor = await get_certificate_monitor(monitor_id)
+
+    enforce_rate_limit(
+        monitor=monitor_id, client=client_address(request), domain=monitor.domain
+    )
+
     return await refresh_certificate_monitor(monitor_id)
 
 
+@app.get("/api/changes", dependencies=[Depends(require_change_feed_token)])
+async def get_changes_api(
+    cursor: str | None = None, limit: Annotated[int, Query(ge=1, le=1000)] = 100
+):
+    validate_change_ids(cursor)
+    changes, cursor = read_changes(cursor, limit)
+
+    return {"changes": changes, "cursor": cursor}
+
+
+@app.get("/api/changes/stream", dependencies=[Depends(require_change_feed_token)])
+async def stream_changes_api(
+    cursor: str | None = None,
+    last_event_id: Annotated[str | None, Header()] = None,
+):
+    # Checked up front, as the response has already started by the time the
+    # stream reads from Redis
+    validate_change_ids(cursor, last_event_id)
+
+    # Browsers resend the last event id when an EventSource reconnects
+    return StreamingResponse(
+        stream_changes(last_event_id or cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# A POST, as reading moves changes into the group's pending list
+@app.post(
+    "/api/changes/groups/{group}",
+    dependencies=[Depends(require_change_feed_token)],
+)
+async def read_group_changes_api(
+    group: str,
+    consumer: str = "default",
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+):
+    return {"changes": read_group_changes(group, consumer, limit)}
+
+
+@app.post(
+    "/api/changes/groups/{group}/ack",
+    dependencies=[Depends(require_change_feed_token)],
+)
+async def ack_group_changes_api(group: str, ack_request: ChangeAckRequest):
+    validate_change_ids(*ack_request.ids)
+    return {"acknowledged": ack_changes(group, ack_request.ids)}
+
+
 @app.on_event("startup")
 async def app_startup():
     for job in scheduler.get_jobs():
@@ -337,3 +493,16 @@ async def app_startup():
         repeat=None,
         result_ttl=60,
     )
+
+    for job in scheduler.get_jobs():
+        if job.func_name == "certainty.compaction.compact_sync":
+            logger.debug(f"Cancelling old compaction scheduled job: {job}")
+            scheduler.cancel(job)
+
+    scheduler.schedule(
+        scheduled_time=datetime.datetime.now(tz=datetime.UTC),
+        func=compact_sync,
+        interval=3600,
+        repeat=None,
+        result_ttl=60,
+    )
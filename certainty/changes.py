@@ -0,0 +1,117 @@
+import datetime
+import json
+import re
+from typing import AsyncIterator
+
+from redis.exceptions import ResponseError
+
+import certainty
+from certainty.models import CertificateMonitor, MonitorState
+
+CHANGES_KEY = "certainty:changes"
+# Roughly how many transitions the feed keeps before trimming the oldest.
+CHANGES_MAXLEN = 100_000
+SSE_BLOCK_MS = 15_000
+CHANGE_ID_PATTERN = re.compile(r"\d+-\d+")
+
+
+def _decode_change(change_id: bytes, fields: dict[bytes, bytes]) -> dict:
+    return {
+        "id": change_id.decode(),
+        **{key.decode(): value.decode() for key, value in fields.items()},
+    }
+
+
+def is_valid_change_id(change_id: str) -> bool:
+    """Whether `change_id` is a full stream entry id, as handed out by the feed."""
+    return CHANGE_ID_PATTERN.fullmatch(change_id) is not None
+
+
+def publish_state_change(
+    monitor: CertificateMonitor, old_state: MonitorState, new_state: MonitorState
+) -> None:
+    certainty.redis_conn.xadd(
+        CHANGES_KEY,
+        {
+            "uuid": str(monitor.uuid),
+            "domain": monitor.domain,
+            "from_state": MonitorState(old_state).value,
+            "to_state": MonitorState(new_state).value,
+            "not_after": monitor.not_after.isoformat() if monitor.not_after else "",
+            "changed_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        },
+        maxlen=CHANGES_MAXLEN,
+        approximate=True,
+    )
+
+
+def read_changes(cursor: str | None, limit: int) -> tuple[list[dict], str | None]:
+    """Return up to `limit` changes after `cursor`, and the cursor to resume from."""
+    start = f"({cursor}" if cursor else "-"
+    changes = [
+        _decode_change(change_id, fields)
+        for change_id, fields in certainty.redis_conn.xrange(
+            CHANGES_KEY, min=start, count=limit
+        )
+    ]
+
+    return changes, changes[-1]["id"] if changes else cursor
+
+
+def read_group_changes(group: str, consumer: str, limit: int) -> list[dict]:
+    """Deliver changes to a consumer group, which tracks its own position in the feed.
+
+    Changes stay pending for the group until acknowledged with `ack_changes`, and
+    are delivered again to the same consumer until they are.
+    """
+    try:
+        certainty.redis_conn.xgroup_create(CHANGES_KEY, group, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+    # Redeliver anything this consumer read but never acknowledged, before
+    # moving on to new changes.
+    for start in ("0", ">"):
+        response = certainty.redis_conn.xreadgroup(
+            group, consumer, {CHANGES_KEY: start}, count=limit
+        )
+        changes = [
+            _decode_change(change_id, fields)
+            for _, entries in response
+            for change_id, fields in entries
+        ]
+        if changes:
+            return changes
+
+    return []
+
+
+def ack_changes(group: str, change_ids: list[str]) -> int:
+    if not change_ids:
+        return 0
+    return certainty.redis_conn.xack(CHANGES_KEY, group, *change_ids)
+
+
+async def stream_changes(last_id: str | None) -> AsyncIterator[str]:
+    """Yield server-sent events for each change after `last_id`, as they happen."""
+    if last_id is None:
+        # Resolve "$" up front, so nothing published between reads is skipped.
+        latest = await certainty.async_redis_conn.xrevrange(CHANGES_KEY, count=1)
+        last_id = latest[0][0].decode() if latest else "0-0"
+
+    while True:
+        response = await certainty.async_redis_conn.xread(
+            {CHANGES_KEY: last_id}, block=SSE_BLOCK_MS
+        )
+
+        if not response:
+            # Keep proxies from closing an idle connection
+            yield ": keepalive\n\n"
+            continue
+
+        for _, entries in response:
+            for change_id, fields in entries:
+                change = _decode_change(change_id, fields)
+                last_id = change["id"]
+                yield f"id: {last_id}\nevent: state_change\ndata: {json.dumps(change)}\n\n"
@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+import os
+
+from tortoise import Tortoise
+from tortoise.expressions import Q
+
+import certainty
+from certainty import logger
+from certainty.models import MAGIC_LINK_TTL, CertificateMonitor, MagicLink
+from certainty.timeline import EXPIRY_KEY, THRESHOLD_KEY, remove_monitor_timeline
+
+COMPACTION_BATCH_SIZE = 500
+# Pause between batches, so the web app can get its writes into SQLite
+COMPACTION_BATCH_PAUSE = 0.1
+
+
+async def compact_magic_links() -> int:
+    """Delete used and expired magic links, a batch at a time."""
+    cutoff = datetime.datetime.now(tz=datetime.timezone.utc) - MAGIC_LINK_TTL
+    deleted = 0
+
+    while (
+        link_ids := await MagicLink.filter(
+            Q(used_at__isnull=False) | Q(created_at__lt=cutoff)
+        )
+        .limit(COMPACTION_BATCH_SIZE)
+        .values_list("id", flat=True)
+    ):
+        deleted += await MagicLink.filter(id__in=link_ids).delete()
+        await asyncio.sleep(COMPACTION_BATCH_PAUSE)
+
+    return deleted
+
+
+async def _remove_orphans(monitor_ids: set[str]) -> int:
+    existing = {
+        str(monitor_id)
+        for monitor_id in await CertificateMonitor.filter(
+            uuid__in=monitor_ids
+        ).values_list("uuid", flat=True)
+    }
+
+    orphans = monitor_ids - existing
+    for monitor_id in orphans:
+        remove_monitor_timeline(monitor_id)
+    return len(orphans)
+
+
+async def compact_timeline() -> int:
+    """Drop expiry timeline entries left behind by monitors that no longer exist."""
+    removed = 0
+
+    for key in (EXPIRY_KEY, THRESHOLD_KEY):
+        monitor_ids = set()
+        for member, _ in certainty.redis_conn.zscan_iter(
+            key, count=COMPACTION_BATCH_SIZE
+        ):
+            # Threshold members are "<uuid>:<state>"
+            monitor_ids.add(member.decode().split(":")[0])
+
+            if len(monitor_ids) >= COMPACTION_BATCH_SIZE:
+                removed += await _remove_orphans(monitor_ids)
+                monitor_ids = set()
+
+        if monitor_ids:
+            removed += await _remove_orphans(monitor_ids)
+
+    return removed
+
+
+async def compact() -> None:
+    await Tortoise.init(
+        db_url=os.getenv("DB_URL"), modules={"models": ["certainty.models"]}
+    )
+
+    logger.info(f"Deleted {await compact_magic_links()} used or expired magic links")
+    logger.info(f"Removed {await compact_timeline()} orphaned timeline entries")
+
+    await Tortoise.close_connections()
+
+
+def compact_sync() -> None:
+    asyncio.run(compact())
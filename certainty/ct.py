@@ -0,0 +1,267 @@
+import asyncio
+import http.client
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Iterable, Iterator
+
+from tortoise import Tortoise
+from tortoise.exceptions import DoesNotExist
+from certainty import logger
+from certainty.models import CertificateMonitor
+from certainty.monitor import refresh_certificate_monitor
+
+BATCH_SIZE = 500
+# Match whatever has arrived after this long, so a quiet stream isn't held back
+BATCH_SECONDS = float(os.getenv("CT_BATCH_SECONDS", "5"))
+INDEX_REFRESH_SECONDS = int(os.getenv("CT_INDEX_REFRESH_SECONDS", "60"))
+# Reconnect if a stream sends nothing at all for this long
+STREAM_TIMEOUT = float(os.getenv("CT_STREAM_TIMEOUT", "300"))
+RECONNECT_BACKOFF_MIN = 1
+RECONNECT_BACKOFF_MAX = 300
+
+
+def normalise_serial(serial: str | None) -> str | None:
+    if serial is None:
+        return None
+    return serial.replace(":", "").upper().lstrip("0") or "0"
+
+
+class DomainIndex:
+    """Maps certificate names onto the monitors that cover them.
+
+    Exact names are looked up directly, and wildcard names (`*.example.com`) are
+    looked up by the parent of each monitored domain, so matching a certificate
+    costs one dict lookup per name no matter how many monitors exist.
+    """
+
+    def __init__(
+        self,
+        monitors: Iterable[CertificateMonitor] = (),
+        seen: set[tuple[str, str | None]] = frozenset(),
+    ):
+        self.by_domain: dict[str, set[str]] = defaultdict(set)
+        self.by_parent: dict[str, set[str]] = defaultdict(set)
+        self.serials: dict[str, str | None] = {}
+        self.built_at = time.monotonic()
+
+        for monitor in monitors:
+            self.add(monitor)
+
+        # (monitor, serial) pairs already seen in the log, as CT logs repeat
+        # entries for precertificates and across logs. Carried over from the
+        # previous index for monitors that still exist.
+        self.seen: set[tuple[str, str | None]] = {
+            (monitor_id, serial)
+            for monitor_id, serial in seen
+            if monitor_id in self.serials
+        }
+
+    def add(self, monitor: CertificateMonitor) -> None:
+        domain = monitor.domain.strip().lower().rstrip(".")
+        monitor_id = str(monitor.uuid)
+
+        self.by_domain[domain].add(monitor_id)
+        if "." in domain:
+            self.by_parent[domain.split(".", 1)[1]].add(monitor_id)
+        self.serials[monitor_id] = normalise_serial(monitor.serial)
+
+    def match(self, names: Iterable[str]) -> set[str]:
+        matched = set()
+        for name in names:
+            name = name.strip().lower().rstrip(".")
+            if name.startswith("*."):
+                matched |= self.by_parent.get(name[2:], set())
+            else:
+                matched |= self.by_domain.get(name, set())
+        return matched
+
+    def __len__(self) -> int:
+        return len(self.serials)
+
+
+def parse_ct_entry(line: str) -> dict | None:
+    """Parse a certstream-style JSON entry, returning its leaf certificate."""
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return None
+
+    if not isinstance(entry, dict):
+        return None
+
+    if "data" in entry:
+        if entry.get("message_type") != "certificate_update":
+            return None
+        entry = entry["data"]
+
+    leaf_cert = entry.get("leaf_cert", entry)
+    if not leaf_cert.get("all_domains"):
+        return None
+
+    return leaf_cert
+
+
+def is_stream(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def iter_ct_lines(source: str) -> Iterator[str]:
+    """Yield raw lines from a local CT dump, or a newline-delimited JSON stream."""
+    if is_stream(source):
+        with urllib.request.urlopen(source, timeout=STREAM_TIMEOUT) as response:
+            for line in response:
+                yield line.decode()
+    else:
+        with open(source) as f:
+            yield from f
+
+
+def match_ct_entries(index: DomainIndex, leaf_certs: Iterable[dict]) -> set[str]:
+    """Return the monitors which have had a certificate issued they aren't serving yet."""
+    issued = set()
+
+    for leaf_cert in leaf_certs:
+        serial = normalise_serial(leaf_cert.get("serial_number"))
+        for monitor_id in index.match(leaf_cert["all_domains"]):
+            if (
+                index.serials[monitor_id] == serial
+                or (monitor_id, serial) in index.seen
+            ):
+                continue
+
+            logger.info(
+                f"CT log shows new certificate {serial} for Monitor {monitor_id}"
+            )
+            index.seen.add((monitor_id, serial))
+            issued.add(monitor_id)
+
+    return issued
+
+
+async def build_domain_index(
+    seen: set[tuple[str, str | None]] = frozenset(),
+) -> DomainIndex:
+    return DomainIndex(await CertificateMonitor.filter(enabled=True), seen)
+
+
+class LineReader:
+    """Reads lines on a background thread, and hands them out in batches.
+
+    A batch is cut short after `BATCH_SECONDS`, so entries on a quiet stream are
+    still matched promptly rather than waiting for a full batch.
+    """
+
+    def __init__(self, lines: Iterator[str]):
+        self.queue: queue.Queue[str | None] = queue.Queue(maxsize=BATCH_SIZE * 4)
+        self.finished = False
+        self.error: Exception | None = None
+        threading.Thread(target=self._read, args=(lines,), daemon=True).start()
+
+    def _read(self, lines: Iterator[str]) -> None:
+        try:
+            for line in lines:
+                self.queue.put(line)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.put(None)
+
+    def read_batch(self) -> list[str]:
+        batch = []
+        deadline = time.monotonic() + BATCH_SECONDS
+
+        while len(batch) < BATCH_SIZE and not self.finished:
+            try:
+                line = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+
+            if line is None:
+                self.finished = True
+            else:
+                batch.append(line)
+
+        return batch
+
+
+async def ingest_ct_lines(lines: Iterator[str], index: DomainIndex) -> DomainIndex:
+    """Ingest lines until they run out, returning the index as last rebuilt."""
+    reader = LineReader(lines)
+
+    while not reader.finished:
+        batch = await asyncio.to_thread(reader.read_batch)
+
+        if time.monotonic() - index.built_at > INDEX_REFRESH_SECONDS:
+            index = await build_domain_index(index.seen)
+
+        leaf_certs = filter(None, map(parse_ct_entry, batch))
+        issued = list(match_ct_entries(index, leaf_certs))
+
+        # A CT entry only tells us a certificate exists; probe to confirm it's deployed.
+        results = await asyncio.gather(
+            *(refresh_certificate_monitor(monitor_id) for monitor_id in issued),
+            return_exceptions=True,
+        )
+        for monitor_id, result in zip(issued, results):
+            if isinstance(result, DoesNotExist):
+                logger.info(f"Monitor {monitor_id} was deleted, skipping")
+            elif isinstance(result, Exception):
+                logger.error(f"Failed to refresh Monitor {monitor_id}", exc_info=result)
+            else:
+                index.add(result)
+
+    if reader.error is not None:
+        raise reader.error
+    return index
+
+
+async def ingest_ct_log(source: str) -> None:
+    await Tortoise.init(
+        db_url=os.getenv("DB_URL"), modules={"models": ["certainty.models"]}
+    )
+
+    index = await build_domain_index()
+    logger.info(f"Ingesting CT entries from {source} for {len(index)} monitors")
+
+    if not is_stream(source):
+        # A local dump is finished with once it's been read
+        await ingest_ct_lines(iter_ct_lines(source), index)
+        await Tortoise.close_connections()
+        return
+
+    # Streams are meant to run forever, so reconnect whenever one ends
+    backoff = RECONNECT_BACKOFF_MIN
+    while True:
+        connected_at = time.monotonic()
+        try:
+            index = await ingest_ct_lines(iter_ct_lines(source), index)
+            logger.warning(f"CT stream {source} ended")
+        except (OSError, http.client.HTTPException) as e:
+            logger.warning(f"CT stream {source} failed: {e}")
+
+        if time.monotonic() - connected_at > RECONNECT_BACKOFF_MAX:
+            backoff = RECONNECT_BACKOFF_MIN
+
+        logger.info(f"Reconnecting to CT stream {source} in {backoff}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+
+
+def ingest_ct_log_sync(source: str) -> None:
+    asyncio.run(ingest_ct_log(source))
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else os.getenv("CT_SOURCE")
+    if not source:
+        sys.exit(
+            "Usage: python -m certainty.ct <dump path or stream URL>, or set CT_SOURCE"
+        )
+
+    ingest_ct_log_sync(source)
@@ -1,3 +1,5 @@
+from pydantic import BaseModel
+
 from certainty.models import CertificateMonitor
 from tortoise.contrib.pydantic import pydantic_model_creator
 
@@ -7,3 +9,7 @@ CertificateMonitorPostRequest = pydantic_model_creator(
     name="CertificateMonitorPostRequest",
     include=["domain", "email", "warning_days"],
 )
+
+
+class ChangeAckRequest(BaseModel):
+    ids: list[str]
@@ -1,10 +1,15 @@
 import datetime
+import os
 import uuid
 from tortoise.models import Model
 from tortoise import fields
 import enum
 import secrets
 
+MAGIC_LINK_TTL = datetime.timedelta(
+    minutes=int(os.getenv("MAGIC_LINK_TTL_MINUTES", "60"))
+)
+
 
 class MonitorState(str, enum.Enum):
     UNKNOWN = "UNKNOWN"
@@ -40,6 +45,13 @@ class CertificateMonitor(Model):
 class MagicLink(Model):
     id = fields.IntField(pk=True)
     email = fields.CharField(max_length=255)
-    token = fields.CharField(max_length=255, default=lambda: secrets.token_urlsafe(32))
-    created_at = fields.DatetimeField(auto_now_add=True)
+    token = fields.CharField(
+        max_length=255, default=lambda: secrets.token_urlsafe(32), index=True
+    )
+    created_at = fields.DatetimeField(auto_now_add=True, index=True)
     used_at = fields.DatetimeField(null=True)
+
+    def is_expired(self) -> bool:
+        return self.created_at + MAGIC_LINK_TTL < datetime.datetime.now(
+            tz=datetime.timezone.utc
+        )
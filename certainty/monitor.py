@@ -1,6 +1,8 @@
 import asyncio
 import datetime
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from tortoise import Tortoise
 import certainty
@@ -12,7 +14,20 @@ from certainty.email import (
     send_monitor_expiring,
     send_monitor_renewed,
 )
+from certainty.changes import publish_state_change
 from certainty.models import CertificateMonitor, MonitorState
+from certainty.probe import probe_certificate
+from certainty.timeline import (
+    pop_due_thresholds,
+    remove_monitor_timeline,
+    update_monitor_timeline,
+)
+
+CHECKER_PROCESSES = int(os.getenv("CHECKER_PROCESSES", "1"))
+CHECKER_BATCH_SIZE = int(os.getenv("CHECKER_BATCH_SIZE", "100"))
+
+# Fields written back after each certificate check
+CHECK_FIELDS = ["serial", "not_before", "not_after", "checked_at", "state"]
 
 
 async def create_certificate_monitor(domain: str, email: str, warning_days: int):
@@ -33,59 +48,40 @@ async def delete_certificate_monitor(
     email, uuid, domain = monitor.email, monitor.uuid, monitor.domain
 
     await monitor.delete()
+    remove_monitor_timeline(uuid)
 
     if send_notification:
         certainty.q.enqueue(send_monitor_deleted, email, domain, uuid)
 
 
-async def refresh_certificate_monitor(monitor_id: int) -> CertificateMonitor:
-    monitor = await CertificateMonitor.get(uuid=monitor_id)
-
-    logger.info(f"Refreshing Monitor {monitor_id} ('{monitor.domain}')")
-
-    if (monitor_detail := await get_certificate_detail(monitor.domain)) is not None:
-        not_before_datetime = datetime.datetime.strptime(
-            monitor_detail["notBefore"], "%b %d %H:%M:%S %Y %Z"
-        )
-        not_after_datetime = datetime.datetime.strptime(
-            monitor_detail["notAfter"], "%b %d %H:%M:%S %Y %Z"
-        )
-
-        monitor = await CertificateMonitor.get(uuid=monitor_id)
-
-        monitor.update_from_dict(
-            {
-                "serial": monitor_detail["serialNumber"],
-                "not_before": not_before_datetime,
-                "not_after": not_after_datetime,
-                "checked_at": datetime.datetime.now(tz=datetime.timezone.utc),
-            }
-        )
-    else:
-        logger.warning(f"Failed to get certificate details for {monitor.domain}")
-        monitor.update_from_dict(
-            {
-                "serial": None,
-                "not_before": None,
-                "not_after": None,
-                "checked_at": datetime.datetime.now(tz=datetime.timezone.utc),
-            }
-        )
+def compute_monitor_state(
+    monitor: CertificateMonitor,
+    now: datetime.datetime | None = None,
+    verified: bool = True,
+) -> MonitorState:
+    if now is None:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
 
     if (
         monitor.not_after is None
         or monitor.not_before is None
         or monitor.serial is None
     ):
-        new_state = MonitorState.ERROR
-    elif monitor.not_after < datetime.datetime.now(tz=datetime.timezone.utc):
-        new_state = MonitorState.EXPIRED
-    elif monitor.not_after < datetime.datetime.now(
-        tz=datetime.timezone.utc
-    ) + datetime.timedelta(days=monitor.warning_days):
-        new_state = MonitorState.EXPIRING
+        return MonitorState.ERROR
+    elif monitor.not_after < now:
+        return MonitorState.EXPIRED
+    elif not verified:
+        return MonitorState.ERROR
+    elif monitor.not_after < now + datetime.timedelta(days=monitor.warning_days):
+        return MonitorState.EXPIRING
     else:
-        new_state = MonitorState.OK
+        return MonitorState.OK
+
+
+def transition_monitor_state(
+    monitor: CertificateMonitor, new_state: MonitorState
+) -> None:
+    monitor_id = monitor.uuid
 
     # State has changed
     if monitor.state != new_state:
@@ -128,11 +124,64 @@ async def refresh_certificate_monitor(monitor_id: int) -> CertificateMonitor:
                 monitor.uuid,
                 monitor.not_after,
             )
+
+        publish_state_change(monitor, monitor.state, new_state)
+
     monitor.state = new_state
 
-    await monitor.save(
-        update_fields=["serial", "not_before", "not_after", "checked_at", "state"]
-    )
+
+def apply_certificate_detail(
+    monitor: CertificateMonitor, monitor_detail: dict | None
+) -> None:
+    if monitor_detail is not None:
+        not_before_datetime = datetime.datetime.strptime(
+            monitor_detail["notBefore"], "%b %d %H:%M:%S %Y %Z"
+        )
+        not_after_datetime = datetime.datetime.strptime(
+            monitor_detail["notAfter"], "%b %d %H:%M:%S %Y %Z"
+        )
+        verified = monitor_detail.get("verified", True)
+
+        if not verified:
+            logger.warning(
+                f"Certificate for {monitor.domain} failed verification: {monitor_detail['verifyError']}"
+            )
+
+        monitor.update_from_dict(
+            {
+                "serial": monitor_detail["serialNumber"],
+                "not_before": not_before_datetime,
+                "not_after": not_after_datetime,
+                "checked_at": datetime.datetime.now(tz=datetime.timezone.utc),
+            }
+        )
+    else:
+        logger.warning(f"Failed to get certificate details for {monitor.domain}")
+        verified = False
+        monitor.update_from_dict(
+            {
+                "serial": None,
+                "not_before": None,
+                "not_after": None,
+                "checked_at": datetime.datetime.now(tz=datetime.timezone.utc),
+            }
+        )
+
+    transition_monitor_state(monitor, compute_monitor_state(monitor, verified=verified))
+
+
+async def refresh_certificate_monitor(monitor_id: int) -> CertificateMonitor:
+    monitor = await CertificateMonitor.get(uuid=monitor_id)
+
+    logger.info(f"Refreshing Monitor {monitor_id} ('{monitor.domain}')")
+
+    monitor_detail = await get_certificate_detail(monitor.domain)
+
+    monitor = await CertificateMonitor.get(uuid=monitor_id)
+    apply_certificate_detail(monitor, monitor_detail)
+
+    await monitor.save(update_fields=CHECK_FIELDS)
+    update_monitor_timeline(monitor)
 
     logger.info(f"Finished refreshing Monitor {monitor_id} ('{monitor.domain}')")
     return monitor
@@ -140,26 +189,114 @@ async def refresh_certificate_monitor(monitor_id: int) -> CertificateMonitor:
 
 async def get_certificate_detail(domain: str) -> dict | None:
     try:
-        _, writer = await asyncio.open_connection(domain, 443, ssl=True)
-        peercert = writer.get_extra_info("peercert")
-        writer.close()
-        return peercert
+        return await probe_certificate(domain)
     except Exception:
         logger.exception(f"Failed to get certificate details for {domain}")
         return None
 
 
+async def apply_due_threshold(monitor_id: str, state: MonitorState) -> None:
+    monitor = await CertificateMonitor.get_or_none(uuid=monitor_id)
+
+    # Monitor was deleted, or re-probed onto a different certificate since. A
+    # certificate that doesn't verify stays in ERROR until it expires, and only a
+    # probe can clear that.
+    if (
+        monitor is None
+        or (monitor.state == MonitorState.ERROR and state == MonitorState.EXPIRING)
+        or compute_monitor_state(monitor) != state
+    ):
+        return
+
+    logger.info(f"Monitor {monitor_id} ('{monitor.domain}') crossed {state} threshold")
+    transition_monitor_state(monitor, state)
+    await monitor.save(update_fields=["state"])
+
+
+async def apply_due_thresholds() -> None:
+    """Move monitors across EXPIRING/EXPIRED thresholds without waiting for a probe."""
+    for monitor_id, state in pop_due_thresholds():
+        # Crossings are already popped, so one bad monitor mustn't lose the rest
+        try:
+            await apply_due_threshold(monitor_id, state)
+        except Exception:
+            logger.exception(
+                f"Failed to apply {state} threshold for Monitor {monitor_id}"
+            )
+
+
+async def probe_domains(domains: list[str]) -> list[tuple[str, dict | None]]:
+    details = await asyncio.gather(*map(get_certificate_detail, domains))
+    return list(zip(domains, details))
+
+
+def probe_domains_sync(domains: list[str]) -> list[tuple[str, dict | None]]:
+    return asyncio.run(probe_domains(domains))
+
+
+async def check_certificates_parallel(
+    monitors: list[CertificateMonitor], processes: int
+) -> None:
+    """Probe across a pool of processes, each running its own event loop.
+
+    Handshakes happen in the pool, while results are applied and written back
+    here, one batch at a time, so the database only ever has a single writer.
+    """
+    domains = list(dict.fromkeys(monitor.domain for monitor in monitors))
+    batches = [
+        domains[i : i + CHECKER_BATCH_SIZE]
+        for i in range(0, len(domains), CHECKER_BATCH_SIZE)
+    ]
+
+    loop = asyncio.get_running_loop()
+    # Don't fork: this runs inside an rq work-horse, with a running event loop,
+    # an aiosqlite thread and open Redis connections, none of which survive it.
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        futures = [
+            loop.run_in_executor(pool, probe_domains_sync, batch) for batch in batches
+        ]
+
+        for future in asyncio.as_completed(futures):
+            monitor_details = dict(await future)
+
+            # Probing can take a while, so pick up any refreshes, deletions or
+            # disabling that happened meanwhile, as refresh_certificate_monitor does.
+            updated = await CertificateMonitor.filter(
+                domain__in=list(monitor_details), enabled=True
+            )
+            for monitor in updated:
+                apply_certificate_detail(monitor, monitor_details[monitor.domain])
+
+            if updated:
+                await CertificateMonitor.bulk_update(updated, fields=CHECK_FIELDS)
+            for monitor in updated:
+                update_monitor_timeline(monitor)
+
+            logger.info(f"Finished refreshing batch of {len(updated)} Monitors")
+
+
 async def check_certificates() -> None:
     await Tortoise.init(
         db_url=os.getenv("DB_URL"), modules={"models": ["certainty.models"]}
     )
 
+    await apply_due_thresholds()
+
     monitors = await CertificateMonitor.filter(
         enabled=True,
         checked_at__lt=datetime.datetime.now(tz=datetime.timezone.utc)
         - datetime.timedelta(minutes=15),
     )
 
+    if CHECKER_PROCESSES > 1:
+        logger.info(
+            f"Running {len(monitors)} Monitors across {CHECKER_PROCESSES} processes"
+        )
+        await check_certificates_parallel(monitors, CHECKER_PROCESSES)
+        return
+
     tasks = []
     for monitor in monitors:
         logger.info(f"Running Monitor {monitor.uuid} ('{monitor.domain}')")
@@ -0,0 +1,111 @@
+import asyncio
+import datetime
+import ssl
+
+PROBE_TIMEOUT = 10
+
+# Built once and shared by every probe, as building a context (and loading the
+# CA bundle into it) costs far more than the handshake itself.
+verified_context = ssl.create_default_context()
+
+# Used to still read the certificate when the chain or hostname doesn't verify.
+unverified_context = ssl.create_default_context()
+unverified_context.check_hostname = False
+unverified_context.verify_mode = ssl.CERT_NONE
+
+
+class ProbeError(Exception):
+    pass
+
+
+def _der_read(data: bytes, offset: int) -> tuple[int, bytes, int]:
+    """Read one DER TLV at `offset`, returning its tag, content and the next offset."""
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[offset : offset + size], "big")
+        offset += size
+
+    return tag, data[offset : offset + length], offset + length
+
+
+def _der_time(tag: int, value: bytes) -> str:
+    if tag == 0x17:  # UTCTime
+        parsed = datetime.datetime.strptime(value.decode(), "%y%m%d%H%M%SZ")
+    elif tag == 0x18:  # GeneralizedTime
+        parsed = datetime.datetime.strptime(value.decode(), "%Y%m%d%H%M%SZ")
+    else:
+        raise ProbeError(f"Unexpected DER time tag {tag:#x}")
+
+    # Match the format `SSLSocket.getpeercert()` uses.
+    return parsed.strftime("%b %d %H:%M:%S %Y GMT")
+
+
+def parse_der_certificate(der: bytes) -> dict:
+    """Pull the serial and validity period out of a DER encoded certificate."""
+    try:
+        _, certificate, _ = _der_read(der, 0)
+        _, tbs_certificate, _ = _der_read(certificate, 0)
+
+        tag, serial, offset = _der_read(tbs_certificate, 0)
+        if tag == 0xA0:  # explicit version, absent for v1 certificates
+            tag, serial, offset = _der_read(tbs_certificate, offset)
+
+        _, _, offset = _der_read(tbs_certificate, offset)  # signature algorithm
+        _, _, offset = _der_read(tbs_certificate, offset)  # issuer
+        _, validity, _ = _der_read(tbs_certificate, offset)
+
+        not_before_tag, not_before, offset = _der_read(validity, 0)
+        not_after_tag, not_after, _ = _der_read(validity, offset)
+    except IndexError:
+        raise ProbeError("Truncated DER certificate")
+
+    return {
+        "serialNumber": (serial.lstrip(b"\x00") or b"\x00").hex().upper(),
+        "notBefore": _der_time(not_before_tag, not_before),
+        "notAfter": _der_time(not_after_tag, not_after),
+    }
+
+
+async def _handshake(domain: str, port: int, context: ssl.SSLContext) -> bytes:
+    loop = asyncio.get_running_loop()
+
+    # A bare Protocol skips the StreamReader/StreamWriter machinery entirely, we
+    # only need the handshake to complete.
+    transport, _ = await asyncio.wait_for(
+        loop.create_connection(
+            asyncio.Protocol,
+            domain,
+            port,
+            ssl=context,
+            server_hostname=domain,
+        ),
+        PROBE_TIMEOUT,
+    )
+
+    try:
+        return transport.get_extra_info("ssl_object").getpeercert(binary_form=True)
+    finally:
+        transport.abort()
+
+
+async def probe_certificate(domain: str, port: int = 443) -> dict:
+    """Handshake with `domain` and return details of the certificate it serves.
+
+    Certificates that fail verification are still returned, with `verified` set to
+    False and the reason in `verifyError`.
+    """
+    try:
+        der = await _handshake(domain, port, verified_context)
+        verify_error = None
+    except ssl.SSLCertVerificationError as e:
+        der = await _handshake(domain, port, unverified_context)
+        verify_error = e.verify_message
+
+    return {
+        **parse_der_certificate(der),
+        "verified": verify_error is None,
+        "verifyError": verify_error,
+    }
@@ -0,0 +1,71 @@
+import certainty
+from certainty import logger
+
+# (capacity, tokens refilled per second) for each kind of bucket
+RATE_LIMITS = {
+    # Matches the old "don't refresh more than every 5 seconds" guard.
+    "monitor": (1, 1 / 5),
+    "client": (20, 20 / 60),
+    "domain": (5, 5 / 60),
+}
+
+# Checks every bucket first and only takes a token from each if all of them
+# have one spare, so a request rejected by one bucket doesn't drain the rest.
+# Runs inside Redis, which keeps it atomic across uvicorn workers.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local tokens = {}
+local retry_after = 0
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+    local bucket = redis.call("HMGET", key, "tokens", "updated_at")
+
+    local available = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + (now - updated_at) * rate)
+
+    if available < 1 then
+        retry_after = math.max(retry_after, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+
+if retry_after > 0 then
+    return tostring(retry_after)
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local rate = tonumber(ARGV[i * 2])
+
+    redis.call("HSET", key, "tokens", tokens[i] - 1, "updated_at", now)
+    redis.call("EXPIRE", key, math.ceil(capacity / rate))
+end
+
+return "0"
+"""
+
+
+def rate_limit(**buckets: str) -> float | None:
+    """Take a token from each named bucket, e.g. `rate_limit(client="1.2.3.4")`.
+
+    Returns None if the request may go ahead, otherwise the number of seconds
+    until it would be allowed.
+    """
+    token_bucket = certainty.redis_conn.register_script(TOKEN_BUCKET_SCRIPT)
+
+    keys, args = [], []
+    for kind, identifier in buckets.items():
+        keys.append(f"certainty:ratelimit:{kind}:{identifier}")
+        args.extend(RATE_LIMITS[kind])
+
+    retry_after = float(token_bucket(keys=keys, args=args))
+
+    if retry_after > 0:
+        logger.info(f"Rate limited {buckets}, retry after {retry_after}s")
+        return retry_after
+    return None
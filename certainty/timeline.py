@@ -0,0 +1,97 @@
+import datetime
+
+import certainty
+from certainty.models import CertificateMonitor, MonitorState
+
+# Sorted set of monitor uuids, scored by their certificate's notAfter timestamp.
+EXPIRY_KEY = "certainty:timeline:expiry"
+# Sorted set of "<uuid>:<state>" members, scored by the instant the monitor
+# will cross into that state.
+THRESHOLD_KEY = "certainty:timeline:thresholds"
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def monitor_thresholds(
+    monitor: CertificateMonitor,
+) -> dict[MonitorState, datetime.datetime]:
+    """Return the instants at which the monitor will next change state on its own."""
+    if monitor.not_after is None:
+        return {}
+
+    not_after = _as_utc(monitor.not_after)
+    warning = datetime.timedelta(days=monitor.warning_days)
+
+    return {
+        MonitorState.EXPIRING: not_after - warning,
+        MonitorState.EXPIRED: not_after,
+    }
+
+
+def update_monitor_timeline(monitor: CertificateMonitor) -> None:
+    remove_monitor_timeline(monitor.uuid)
+
+    if monitor.not_after is None or not monitor.enabled:
+        return
+
+    pipe = certainty.redis_conn.pipeline()
+    pipe.zadd(EXPIRY_KEY, {str(monitor.uuid): _as_utc(monitor.not_after).timestamp()})
+
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    for state, crossing_at in monitor_thresholds(monitor).items():
+        # Thresholds already behind us have been taken care of by the probe.
+        if crossing_at > now:
+            pipe.zadd(
+                THRESHOLD_KEY,
+                {f"{monitor.uuid}:{state.value}": crossing_at.timestamp()},
+            )
+    pipe.execute()
+
+
+def remove_monitor_timeline(monitor_id: str) -> None:
+    pipe = certainty.redis_conn.pipeline()
+    pipe.zrem(EXPIRY_KEY, str(monitor_id))
+    pipe.zrem(
+        THRESHOLD_KEY,
+        *(f"{monitor_id}:{state.value}" for state in MonitorState),
+    )
+    pipe.execute()
+
+
+def pop_due_thresholds(
+    now: datetime.datetime | None = None,
+) -> list[tuple[str, MonitorState]]:
+    """Atomically remove and return every threshold crossing up to `now`."""
+    if now is None:
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+    pipe = certainty.redis_conn.pipeline()
+    pipe.zrangebyscore(THRESHOLD_KEY, "-inf", now.timestamp())
+    pipe.zremrangebyscore(THRESHOLD_KEY, "-inf", now.timestamp())
+    members, _ = pipe.execute()
+
+    due = []
+    for member in members:
+        monitor_id, state = member.decode().rsplit(":", 1)
+        due.append((monitor_id, MonitorState(state)))
+    return due
+
+
+def expiring_within(days: int, limit: int, offset: int = 0) -> list[str]:
+    """Return the uuids of monitors whose certificate expires in the next `days` days.
+
+    Soonest first, `limit` at a time starting from the `offset`th.
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    until = now + datetime.timedelta(days=days)
+
+    return [
+        monitor_id.decode()
+        for monitor_id in certainty.redis_conn.zrangebyscore(
+            EXPIRY_KEY, now.timestamp(), until.timestamp(), start=offset, num=limit
+        )
+    ]
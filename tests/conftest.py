@@ -0,0 +1,45 @@
+import os
+
+os.environ.setdefault("SESSION_SECRET", "test-session-secret")
+
+import fakeredis
+import httpx
+import pytest
+import pytest_asyncio
+from tortoise import Tortoise
+
+import certainty
+
+
+@pytest_asyncio.fixture
+async def db():
+    await Tortoise.init(
+        db_url="sqlite://:memory:", modules={"models": ["certainty.models"]}
+    )
+    await Tortoise.generate_schemas()
+    yield
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    server = fakeredis.FakeServer()
+    redis_conn = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(certainty, "redis_conn", redis_conn)
+    monkeypatch.setattr(
+        certainty, "async_redis_conn", fakeredis.aioredis.FakeRedis(server=server)
+    )
+    return redis_conn
+
+
+@pytest.fixture
+def queue(mocker):
+    return mocker.patch("certainty.q")
+
+
+@pytest_asyncio.fixture
+async def api(db, redis, queue):
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=certainty.app), base_url="http://test"
+    ) as client:
+        yield client
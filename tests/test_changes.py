@@ -0,0 +1,181 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from certainty.changes import (
+    CHANGES_KEY,
+    ack_changes,
+    publish_state_change,
+    read_changes,
+    read_group_changes,
+    stream_changes,
+)
+from certainty.models import CertificateMonitor, MonitorState
+
+HEADERS = {"Authorization": "Bearer token"}
+
+
+def publish(domain: str) -> CertificateMonitor:
+    monitor = CertificateMonitor(
+        domain=domain,
+        email="changes@test.com",
+        not_after=datetime(2024, 5, 30, 23, 59, 59, tzinfo=timezone.utc),
+    )
+    publish_state_change(monitor, MonitorState.OK, MonitorState.EXPIRING)
+    return monitor
+
+
+def test_read_changes(redis):
+    first = publish("first.com")
+    publish("second.com")
+    publish("third.com")
+
+    changes, cursor = read_changes(None, 2)
+    assert [change["domain"] for change in changes] == ["first.com", "second.com"]
+    assert changes[0]["uuid"] == str(first.uuid)
+    assert changes[0]["from_state"] == "OK"
+    assert changes[0]["to_state"] == "EXPIRING"
+    assert changes[0]["not_after"] == "2024-05-30T23:59:59+00:00"
+    assert cursor == changes[-1]["id"]
+
+    changes, cursor = read_changes(cursor, 2)
+    assert [change["domain"] for change in changes] == ["third.com"]
+
+    # Nothing new, so the cursor stays put
+    assert read_changes(cursor, 2) == ([], cursor)
+
+
+def test_read_group_changes(redis):
+    publish("first.com")
+    publish("second.com")
+
+    changes = read_group_changes("group", "consumer", 10)
+    assert [change["domain"] for change in changes] == ["first.com", "second.com"]
+    assert redis.xpending(CHANGES_KEY, "group")["pending"] == 2
+
+    assert ack_changes("group", [change["id"] for change in changes]) == 2
+    assert redis.xpending(CHANGES_KEY, "group")["pending"] == 0
+    assert read_group_changes("group", "consumer", 10) == []
+
+    publish("third.com")
+    changes = read_group_changes("group", "consumer", 10)
+    assert [change["domain"] for change in changes] == ["third.com"]
+
+    # Other groups keep their own position
+    assert len(read_group_changes("other", "consumer", 10)) == 3
+
+
+def test_read_group_changes_redelivers_pending(redis, mocker):
+    # fakeredis doesn't return a consumer's pending entries for an explicit id,
+    # so stand in for what Redis replies with.
+    xreadgroup = mocker.patch.object(
+        redis,
+        "xreadgroup",
+        return_value=[[CHANGES_KEY.encode(), [(b"1-0", {b"domain": b"first.com"})]]],
+    )
+
+    changes = read_group_changes("group", "consumer", 10)
+
+    assert changes == [{"id": "1-0", "domain": "first.com"}]
+    # New changes aren't read until the pending ones are acknowledged
+    xreadgroup.assert_called_once_with(
+        "group", "consumer", {CHANGES_KEY: "0"}, count=10
+    )
+
+
+@pytest.mark.asyncio
+async def test_stream_changes(redis, mocker):
+    mocker.patch("certainty.changes.SSE_BLOCK_MS", 10)
+    publish("first.com")
+    publish("second.com")
+    first_id = read_changes(None, 1)[0][0]["id"]
+
+    stream = stream_changes(first_id)
+
+    event = await anext(stream)
+    id_line, event_line, data_line, *rest = event.split("\n")
+    change = json.loads(data_line.removeprefix("data: "))
+    assert id_line == f"id: {change['id']}"
+    assert event_line == "event: state_change"
+    assert change["domain"] == "second.com"
+    assert rest == ["", ""]
+
+    assert await anext(stream) == ": keepalive\n\n"
+
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_stream_changes_from_latest(redis, mocker):
+    mocker.patch("certainty.changes.SSE_BLOCK_MS", 10)
+    publish("before.com")
+
+    stream = stream_changes(None)
+    assert await anext(stream) == ": keepalive\n\n"
+
+    publish("after.com")
+    assert '"domain": "after.com"' in await anext(stream)
+
+    await stream.aclose()
+
+
+@pytest.mark.asyncio
+async def test_changes_api_requires_token(api, monkeypatch):
+    response = await api.get("/api/changes", headers=HEADERS)
+    assert response.status_code == 401
+
+    monkeypatch.setenv("CHANGE_FEED_TOKEN", "token")
+    response = await api.get("/api/changes", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+
+    # Headers are decoded as latin-1, so may hold characters outside ASCII
+    response = await api.get(
+        "/api/changes", headers={"Authorization": "Bearer \xe9".encode("latin-1")}
+    )
+    assert response.status_code == 401
+
+    publish("first.com")
+    response = await api.get("/api/changes", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()["changes"][0]["domain"] == "first.com"
+
+
+@pytest.mark.asyncio
+async def test_changes_api_rejects_invalid_ids(api, monkeypatch):
+    monkeypatch.setenv("CHANGE_FEED_TOKEN", "token")
+
+    response = await api.get("/api/changes?cursor=nonsense", headers=HEADERS)
+    assert response.status_code == 400
+
+    response = await api.get(
+        "/api/changes/stream", headers={**HEADERS, "Last-Event-ID": "nonsense"}
+    )
+    assert response.status_code == 400
+
+    response = await api.post(
+        "/api/changes/groups/group/ack", headers=HEADERS, json={"ids": ["0-"]}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_group_changes_api(api, monkeypatch):
+    monkeypatch.setenv("CHANGE_FEED_TOKEN", "token")
+    publish("first.com")
+
+    # Reading claims changes for the group, so isn't safe as a GET
+    response = await api.get("/api/changes/groups/group", headers=HEADERS)
+    assert response.status_code == 405
+
+    response = await api.post("/api/changes/groups/group", headers=HEADERS)
+    assert response.status_code == 200
+    changes = response.json()["changes"]
+    assert [change["domain"] for change in changes] == ["first.com"]
+
+    response = await api.post(
+        "/api/changes/groups/group/ack",
+        headers=HEADERS,
+        json={"ids": [change["id"] for change in changes]},
+    )
+    assert response.json() == {"acknowledged": 1}
@@ -0,0 +1,130 @@
+import os
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from certainty.models import CertificateMonitor, MonitorState
+from certainty.monitor import (
+    apply_certificate_detail,
+    check_certificates_parallel,
+    probe_domains_sync,
+)
+from certainty.timeline import EXPIRY_KEY
+
+CERTIFICATE_DETAIL = {
+    "serialNumber": "1234567890",
+    "notBefore": "May 30 00:00:00 2023 GMT",
+    "notAfter": "May 30 23:59:59 2099 GMT",
+}
+
+
+def test_apply_certificate_detail(redis, queue):
+    monitor = CertificateMonitor(domain="checker.com", email="checker@test.com")
+
+    apply_certificate_detail(monitor, CERTIFICATE_DETAIL)
+
+    assert monitor.serial == "1234567890"
+    assert monitor.not_before == datetime(2023, 5, 30, 0, 0, 0, tzinfo=timezone.utc)
+    assert monitor.not_after == datetime(2099, 5, 30, 23, 59, 59, tzinfo=timezone.utc)
+    assert monitor.checked_at is not None
+    assert monitor.state == MonitorState.OK
+
+
+def test_apply_certificate_detail_unverified(redis, queue):
+    monitor = CertificateMonitor(domain="checker.com", email="checker@test.com")
+
+    apply_certificate_detail(
+        monitor,
+        {**CERTIFICATE_DETAIL, "verified": False, "verifyError": "self-signed"},
+    )
+
+    assert monitor.serial == "1234567890"
+    assert monitor.state == MonitorState.ERROR
+
+
+def test_apply_certificate_detail_failed_probe(redis, queue):
+    monitor = CertificateMonitor(
+        domain="checker.com", email="checker@test.com", serial="1234567890"
+    )
+
+    apply_certificate_detail(monitor, None)
+
+    assert monitor.serial is None
+    assert monitor.not_after is None
+    assert monitor.state == MonitorState.ERROR
+
+
+@pytest.mark.asyncio
+async def test_check_certificates_parallel(db, redis, queue, mocker):
+    # Threads, so the mocked probe reaches the workers
+    mocker.patch(
+        "certainty.monitor.ProcessPoolExecutor",
+        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers),
+    )
+    mocker.patch(
+        "certainty.monitor.get_certificate_detail", return_value=CERTIFICATE_DETAIL
+    )
+    mocker.patch("certainty.monitor.CHECKER_BATCH_SIZE", 2)
+
+    checked_at = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+    for domain in ["a.com", "b.com", "c.com", "a.com", "deleted.com", "disabled.com"]:
+        await CertificateMonitor.create(
+            domain=domain, email="checker@test.com", checked_at=checked_at
+        )
+    monitors = await CertificateMonitor.all()
+
+    # Changed after the checker loaded its monitors, but before probes finished
+    await CertificateMonitor.filter(domain="deleted.com").delete()
+    await CertificateMonitor.filter(domain="disabled.com").update(enabled=False)
+
+    await check_certificates_parallel(monitors, 2)
+
+    checked = await CertificateMonitor.filter(domain__in=["a.com", "b.com", "c.com"])
+    assert len(checked) == 4
+    assert all(monitor.serial == "1234567890" for monitor in checked)
+    assert all(monitor.state == MonitorState.OK for monitor in checked)
+
+    disabled = await CertificateMonitor.get(domain="disabled.com")
+    assert disabled.serial is None
+    assert disabled.state == MonitorState.UNKNOWN
+
+    assert not await CertificateMonitor.filter(domain="deleted.com").exists()
+    assert redis.zcard(EXPIRY_KEY) == 4
+
+
+async def get_worker_certificate_detail(domain):
+    # Stands in for the probe, reporting which process it ran in
+    return {**CERTIFICATE_DETAIL, "serialNumber": str(os.getpid())}
+
+
+def probe_domains_in_worker(domains):
+    # Runs in a pool process, out of reach of the parent's mocks, so patch the
+    # probe there and go through the real probe_domains_sync.
+    monitor_module = sys.modules["certainty.monitor"]
+    monitor_module.get_certificate_detail = get_worker_certificate_detail
+    return monitor_module.probe_domains_sync(domains)
+
+
+def test_probe_domains_sync_pickles():
+    assert pickle.loads(pickle.dumps(probe_domains_sync)) is probe_domains_sync
+
+
+@pytest.mark.asyncio
+async def test_check_certificates_parallel_processes(db, redis, queue, mocker):
+    mocker.patch("certainty.monitor.probe_domains_sync", probe_domains_in_worker)
+    mocker.patch("certainty.monitor.CHECKER_BATCH_SIZE", 1)
+
+    checked_at = datetime.now(tz=timezone.utc) - timedelta(hours=1)
+    for domain in ["a.com", "b.com"]:
+        await CertificateMonitor.create(
+            domain=domain, email="checker@test.com", checked_at=checked_at
+        )
+
+    await check_certificates_parallel(await CertificateMonitor.all(), 2)
+
+    checked = await CertificateMonitor.all()
+    assert all(monitor.state == MonitorState.OK for monitor in checked)
+    assert all(monitor.serial not in (None, str(os.getpid())) for monitor in checked)
@@ -0,0 +1,222 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+from tortoise import Tortoise
+from tortoise.exceptions import DoesNotExist
+
+from certainty.ct import (
+    DomainIndex,
+    LineReader,
+    ingest_ct_log,
+    match_ct_entries,
+    parse_ct_entry,
+)
+from certainty.models import CertificateMonitor
+
+
+def make_index_monitors():
+    return [
+        CertificateMonitor(
+            uuid="0c5a6a8e-4c39-4e0b-9f69-f1f0a6c3a1a1",
+            domain="www.example.com",
+            email="ct@example.com",
+            serial="0A1B",
+        ),
+        CertificateMonitor(
+            uuid="6d1f6c0e-18f1-4b67-8d8b-43d1b1a4f5c2",
+            domain="example.com",
+            email="ct@example.com",
+        ),
+    ]
+
+
+def make_index():
+    return DomainIndex(make_index_monitors())
+
+
+def test_domain_index_match():
+    index = make_index()
+
+    assert index.match(["www.example.com"]) == {"0c5a6a8e-4c39-4e0b-9f69-f1f0a6c3a1a1"}
+    assert index.match(["*.example.com"]) == {"0c5a6a8e-4c39-4e0b-9f69-f1f0a6c3a1a1"}
+    assert index.match(["EXAMPLE.com."]) == {"6d1f6c0e-18f1-4b67-8d8b-43d1b1a4f5c2"}
+    assert index.match(["*.www.example.com", "other.com"]) == set()
+
+
+def test_parse_ct_entry():
+    leaf_cert = {"all_domains": ["example.com"], "serial_number": "0A1B"}
+
+    assert parse_ct_entry(json.dumps(leaf_cert)) == leaf_cert
+    assert (
+        parse_ct_entry(
+            json.dumps(
+                {
+                    "message_type": "certificate_update",
+                    "data": {"leaf_cert": leaf_cert},
+                }
+            )
+        )
+        == leaf_cert
+    )
+    assert parse_ct_entry(json.dumps({"message_type": "heartbeat", "data": {}})) is None
+    assert parse_ct_entry("not json") is None
+
+
+def test_match_ct_entries_skips_deployed_and_repeated_serials():
+    index = make_index()
+
+    issued = match_ct_entries(
+        index,
+        [
+            {"all_domains": ["www.example.com"], "serial_number": "0a:1b"},
+            {"all_domains": ["*.example.com"], "serial_number": "2C3D"},
+            {"all_domains": ["*.example.com"], "serial_number": "2C3D"},
+        ],
+    )
+
+    assert issued == {"0c5a6a8e-4c39-4e0b-9f69-f1f0a6c3a1a1"}
+    assert (
+        match_ct_entries(
+            index, [{"all_domains": ["*.example.com"], "serial_number": "2C3D"}]
+        )
+        == set()
+    )
+
+
+def test_domain_index_carries_seen_serials_across_rebuilds():
+    index = make_index()
+    match_ct_entries(
+        index,
+        [
+            {"all_domains": ["www.example.com"], "serial_number": "2C3D"},
+            {"all_domains": ["example.com"], "serial_number": "AA"},
+        ],
+    )
+
+    # Rebuilt after the example.com monitor was deleted
+    rebuilt = DomainIndex(make_index_monitors()[:1], index.seen)
+
+    assert rebuilt.seen == {("0c5a6a8e-4c39-4e0b-9f69-f1f0a6c3a1a1", "2C3D")}
+    assert (
+        match_ct_entries(
+            rebuilt, [{"all_domains": ["*.example.com"], "serial_number": "2C3D"}]
+        )
+        == set()
+    )
+
+
+@pytest.mark.asyncio
+async def test_ingest_ct_log_survives_deleted_monitors(tmp_path, monkeypatch, mocker):
+    monkeypatch.setenv("DB_URL", f"sqlite://{tmp_path / 'db.sqlite3'}")
+    await Tortoise.init(
+        db_url=os.getenv("DB_URL"), modules={"models": ["certainty.models"]}
+    )
+    await Tortoise.generate_schemas()
+    deleted = await CertificateMonitor.create(domain="deleted.com", email="ct@ct.com")
+    kept = await CertificateMonitor.create(domain="kept.com", email="ct@ct.com")
+    await Tortoise.close_connections()
+
+    dump = tmp_path / "dump.jsonl"
+    dump.write_text(
+        "\n".join(
+            json.dumps({"all_domains": [domain], "serial_number": "2C3D"})
+            for domain in ["deleted.com", "kept.com", "kept.com"]
+        )
+    )
+
+    async def refresh(monitor_id):
+        if monitor_id == str(deleted.uuid):
+            raise DoesNotExist("CertificateMonitor")
+        return kept
+
+    refresh_mock = mocker.patch(
+        "certainty.ct.refresh_certificate_monitor", side_effect=refresh
+    )
+
+    await ingest_ct_log(str(dump))
+
+    assert sorted(call.args[0] for call in refresh_mock.call_args_list) == sorted(
+        [str(deleted.uuid), str(kept.uuid)]
+    )
+
+
+def test_line_reader_flushes_partial_batches(mocker):
+    mocker.patch("certainty.ct.BATCH_SECONDS", 0.05)
+    quiet = threading.Event()
+
+    def lines():
+        yield "first"
+        yield "second"
+        # A stream with nothing more to say for now
+        quiet.wait()
+        yield "third"
+
+    reader = LineReader(lines())
+
+    assert reader.read_batch() == ["first", "second"]
+    assert reader.read_batch() == []
+    assert not reader.finished
+
+    quiet.set()
+    assert reader.read_batch() == ["third"]
+    assert reader.finished
+
+
+def test_line_reader_records_errors():
+    def lines():
+        yield "first"
+        raise TimeoutError("timed out")
+
+    reader = LineReader(lines())
+
+    assert reader.read_batch() == ["first"]
+    assert reader.finished
+    assert isinstance(reader.error, TimeoutError)
+
+
+class StopIngesting(Exception):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_ingest_ct_log_reconnects_to_streams(db, mocker):
+    mocker.patch("certainty.ct.Tortoise.init")
+    mocker.patch("certainty.ct.RECONNECT_BACKOFF_MIN", 0)
+    monitor = await CertificateMonitor.create(domain="stream.com", email="ct@ct.com")
+    entry = json.dumps({"all_domains": ["stream.com"], "serial_number": "2C3D"})
+
+    def stalled():
+        raise TimeoutError("timed out")
+        yield
+
+    def closed():
+        yield entry
+
+    # Fails, then closes cleanly, and is reconnected to after both
+    iter_ct_lines = mocker.patch(
+        "certainty.ct.iter_ct_lines", side_effect=[stalled(), closed(), StopIngesting]
+    )
+    refresh_mock = mocker.patch(
+        "certainty.ct.refresh_certificate_monitor", return_value=monitor
+    )
+
+    with pytest.raises(StopIngesting):
+        await ingest_ct_log("https://ct.example.com/stream")
+
+    assert iter_ct_lines.call_count == 3
+    refresh_mock.assert_called_once_with(str(monitor.uuid))
+
+
+def test_ct_requires_a_source():
+    env = {key: value for key, value in os.environ.items() if key != "CT_SOURCE"}
+
+    result = subprocess.run(
+        [sys.executable, "-m", "certainty.ct"], env=env, capture_output=True, text=True
+    )
+
+    assert result.returncode == 1
+    assert "Usage: python -m certainty.ct" in result.stderr
@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from certainty.compaction import compact_magic_links, compact_timeline
+from certainty.models import MAGIC_LINK_TTL, CertificateMonitor, MagicLink
+from certainty.timeline import EXPIRY_KEY, THRESHOLD_KEY
+
+
+async def create_magic_link(age: timedelta = timedelta(), used: bool = False):
+    ml = await MagicLink.create(email="magic@test.com")
+    # created_at is set on insert, so backdate it afterwards
+    await MagicLink.filter(id=ml.id).update(
+        created_at=ml.created_at - age, used_at=ml.created_at if used else None
+    )
+    return await MagicLink.get(id=ml.id)
+
+
+def test_magic_link_is_expired():
+    now = datetime.now(tz=timezone.utc)
+
+    fresh = MagicLink(email="magic@test.com", created_at=now)
+    stale = MagicLink(
+        email="magic@test.com", created_at=now - MAGIC_LINK_TTL - timedelta(seconds=1)
+    )
+
+    assert not fresh.is_expired()
+    assert stale.is_expired()
+
+
+@pytest.mark.asyncio
+async def test_management_magic_link(api):
+    ml = await create_magic_link()
+
+    response = await api.get(f"/management/{ml.token}")
+    assert response.status_code == 307
+    assert response.headers["location"] == "/management"
+
+    # Links can only be used once
+    response = await api.get(f"/management/{ml.token}")
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_management_magic_link_rejected(api):
+    expired = await create_magic_link(age=MAGIC_LINK_TTL + timedelta(minutes=1))
+
+    response = await api.get(f"/management/{expired.token}")
+    assert response.status_code == 403
+    assert (await MagicLink.get(id=expired.id)).used_at is None
+
+    response = await api.get("/management/unknown")
+    assert response.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_management_magic_link_concurrent_claims(api):
+    ml = await create_magic_link()
+
+    responses = await asyncio.gather(
+        api.get(f"/management/{ml.token}"), api.get(f"/management/{ml.token}")
+    )
+
+    assert sorted(response.status_code for response in responses) == [307, 403]
+
+
+@pytest.mark.asyncio
+async def test_compact_magic_links(db, mocker):
+    mocker.patch("certainty.compaction.COMPACTION_BATCH_SIZE", 2)
+    mocker.patch("certainty.compaction.COMPACTION_BATCH_PAUSE", 0)
+
+    fresh = await create_magic_link()
+    for _ in range(3):
+        await create_magic_link(used=True)
+    for _ in range(2):
+        await create_magic_link(age=MAGIC_LINK_TTL + timedelta(minutes=1))
+
+    assert await compact_magic_links() == 5
+    assert await MagicLink.all().values_list("id", flat=True) == [fresh.id]
+
+
+@pytest.mark.asyncio
+async def test_compact_timeline(db, redis, mocker):
+    mocker.patch("certainty.compaction.COMPACTION_BATCH_SIZE", 2)
+    monitor = await CertificateMonitor.create(
+        domain="compaction.com", email="compaction@test.com"
+    )
+    orphans = [
+        "11111111-1111-1111-1111-111111111111",
+        "22222222-2222-2222-2222-222222222222",
+    ]
+
+    for monitor_id in [str(monitor.uuid), *orphans]:
+        redis.zadd(EXPIRY_KEY, {monitor_id: 1})
+        redis.zadd(
+            THRESHOLD_KEY, {f"{monitor_id}:EXPIRING": 1, f"{monitor_id}:EXPIRED": 2}
+        )
+    # Only found by scanning the threshold set
+    redis.zadd(THRESHOLD_KEY, {"33333333-3333-3333-3333-333333333333:EXPIRED": 3})
+
+    assert await compact_timeline() == 3
+
+    assert redis.zrange(EXPIRY_KEY, 0, -1) == [str(monitor.uuid).encode()]
+    assert sorted(redis.zrange(THRESHOLD_KEY, 0, -1)) == [
+        f"{monitor.uuid}:EXPIRED".encode(),
+        f"{monitor.uuid}:EXPIRING".encode(),
+    ]
@@ -0,0 +1,54 @@
+import pytest
+from certainty.ratelimit import rate_limit
+
+
+def test_rate_limit_allows_then_denies(redis):
+    assert rate_limit(monitor="m1") is None
+
+    retry_after = rate_limit(monitor="m1")
+    assert retry_after == pytest.approx(5, abs=0.5)
+
+    assert rate_limit(monitor="m2") is None
+
+
+def test_rejected_request_does_not_drain_other_buckets(redis):
+    assert rate_limit(monitor="m1", client="c1", domain="example.com") is None
+    assert rate_limit(monitor="m1", client="c1", domain="example.com") is not None
+
+    # Only the first, allowed, request took a token from these buckets
+    client_tokens = float(redis.hget("certainty:ratelimit:client:c1", "tokens"))
+    domain_tokens = float(
+        redis.hget("certainty:ratelimit:domain:example.com", "tokens")
+    )
+    assert client_tokens == pytest.approx(19, abs=0.1)
+    assert domain_tokens == pytest.approx(4, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_create_monitor_api_rate_limited_per_domain(api, mocker):
+    mocker.patch("certainty.monitor.get_certificate_detail", return_value=None)
+
+    # Differently written forms of a domain share the same bucket
+    for domain in [
+        "ratelimit.com",
+        "RateLimit.com",
+        " RATELIMIT.COM ",
+        "ratelimit.com",
+    ]:
+        response = await api.post(
+            "/api/monitors",
+            json={"domain": domain, "email": "rl@example.com", "warning_days": 7},
+        )
+        assert response.status_code == 200
+
+    await api.post(
+        "/api/monitors",
+        json={"domain": "ratelimit.com", "email": "rl@example.com", "warning_days": 7},
+    )
+    response = await api.post(
+        "/api/monitors",
+        json={"domain": "Ratelimit.COM", "email": "rl@example.com", "warning_days": 7},
+    )
+
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 12
@@ -0,0 +1,236 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from certainty.email import send_monitor_expiring
+from certainty.models import CertificateMonitor, MonitorState
+from certainty.monitor import (
+    apply_due_thresholds,
+    compute_monitor_state,
+    transition_monitor_state,
+)
+from certainty.timeline import (
+    EXPIRY_KEY,
+    THRESHOLD_KEY,
+    monitor_thresholds,
+    pop_due_thresholds,
+    update_monitor_timeline,
+)
+
+
+def test_monitor_thresholds():
+    not_after = datetime(2024, 5, 30, 23, 59, 59, tzinfo=timezone.utc)
+    monitor = CertificateMonitor(
+        domain="timeline.com",
+        email="timeline@test.com",
+        warning_days=7,
+        not_after=not_after,
+    )
+
+    thresholds = monitor_thresholds(monitor)
+
+    assert thresholds[MonitorState.EXPIRING] == not_after - timedelta(days=7)
+    assert thresholds[MonitorState.EXPIRED] == not_after
+
+
+def test_monitor_thresholds_without_certificate():
+    monitor = CertificateMonitor(domain="timeline.com", email="timeline@test.com")
+
+    assert monitor_thresholds(monitor) == {}
+
+
+def test_compute_monitor_state():
+    not_after = datetime(2024, 5, 30, 23, 59, 59, tzinfo=timezone.utc)
+    monitor = CertificateMonitor(
+        domain="timeline.com",
+        email="timeline@test.com",
+        warning_days=7,
+        serial="1234567890",
+        not_before=datetime(2023, 5, 30, tzinfo=timezone.utc),
+        not_after=not_after,
+    )
+
+    assert (
+        compute_monitor_state(monitor, not_after - timedelta(days=8)) == MonitorState.OK
+    )
+    assert (
+        compute_monitor_state(monitor, not_after - timedelta(days=1))
+        == MonitorState.EXPIRING
+    )
+    assert (
+        compute_monitor_state(monitor, not_after + timedelta(seconds=1))
+        == MonitorState.EXPIRED
+    )
+
+    # A certificate that doesn't verify is an error until it expires anyway
+    assert (
+        compute_monitor_state(monitor, not_after - timedelta(days=30), verified=False)
+        == MonitorState.ERROR
+    )
+    assert (
+        compute_monitor_state(monitor, not_after + timedelta(days=1), verified=False)
+        == MonitorState.EXPIRED
+    )
+
+
+async def create_monitor(not_after, state=MonitorState.OK, warning_days=7):
+    return await CertificateMonitor.create(
+        domain="timeline.com",
+        email="timeline@test.com",
+        warning_days=warning_days,
+        state=state,
+        serial="1234567890",
+        not_before=not_after - timedelta(days=90),
+        not_after=not_after,
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_monitor_timeline(db, redis):
+    now = datetime.now(tz=timezone.utc)
+    monitor = await create_monitor(now + timedelta(days=10))
+
+    update_monitor_timeline(monitor)
+
+    assert redis.zscore(EXPIRY_KEY, str(monitor.uuid)) == pytest.approx(
+        monitor.not_after.timestamp()
+    )
+    assert redis.zscore(THRESHOLD_KEY, f"{monitor.uuid}:EXPIRING") == pytest.approx(
+        (monitor.not_after - timedelta(days=7)).timestamp()
+    )
+    assert redis.zscore(THRESHOLD_KEY, f"{monitor.uuid}:EXPIRED") == pytest.approx(
+        monitor.not_after.timestamp()
+    )
+
+    # Crossings already behind us aren't recorded again
+    monitor.not_after = now + timedelta(days=3)
+    update_monitor_timeline(monitor)
+
+    assert redis.zrange(THRESHOLD_KEY, 0, -1) == [f"{monitor.uuid}:EXPIRED".encode()]
+
+
+def test_pop_due_thresholds(redis):
+    now = datetime.now(tz=timezone.utc)
+    redis.zadd(
+        THRESHOLD_KEY,
+        {
+            "due:EXPIRING": (now - timedelta(seconds=1)).timestamp(),
+            "later:EXPIRED": (now + timedelta(days=1)).timestamp(),
+        },
+    )
+
+    assert pop_due_thresholds(now) == [("due", MonitorState.EXPIRING)]
+    assert pop_due_thresholds(now) == []
+    assert redis.zrange(THRESHOLD_KEY, 0, -1) == [b"later:EXPIRED"]
+
+
+@pytest.mark.asyncio
+async def test_apply_due_thresholds(db, redis, queue):
+    now = datetime.now(tz=timezone.utc)
+    monitor = await create_monitor(now + timedelta(days=6))
+    redis.zadd(
+        THRESHOLD_KEY,
+        {f"{monitor.uuid}:EXPIRING": (now - timedelta(days=1)).timestamp()},
+    )
+
+    await apply_due_thresholds()
+
+    monitor = await CertificateMonitor.get(uuid=monitor.uuid)
+    assert monitor.state == MonitorState.EXPIRING
+    assert queue.enqueue.call_args.args[0] == send_monitor_expiring
+    assert redis.zcard(THRESHOLD_KEY) == 0
+
+
+@pytest.mark.asyncio
+async def test_apply_due_thresholds_continues_after_failure(db, redis, queue, mocker):
+    now = datetime.now(tz=timezone.utc)
+    first = await create_monitor(now + timedelta(days=6))
+    second = await create_monitor(now + timedelta(days=5))
+    redis.zadd(
+        THRESHOLD_KEY,
+        {
+            f"{first.uuid}:EXPIRING": (now - timedelta(days=2)).timestamp(),
+            f"{second.uuid}:EXPIRING": (now - timedelta(days=1)).timestamp(),
+        },
+    )
+
+    def fail_first(monitor, state):
+        if monitor.uuid == first.uuid:
+            raise RuntimeError("boom")
+        transition_monitor_state(monitor, state)
+
+    mocker.patch("certainty.monitor.transition_monitor_state", side_effect=fail_first)
+
+    await apply_due_thresholds()
+
+    assert (await CertificateMonitor.get(uuid=first.uuid)).state == MonitorState.OK
+    assert (
+        await CertificateMonitor.get(uuid=second.uuid)
+    ).state == MonitorState.EXPIRING
+
+
+@pytest.mark.asyncio
+async def test_get_expiring_monitors_api(api, monkeypatch):
+    now = datetime.now(tz=timezone.utc)
+    sooner = await create_monitor(now + timedelta(days=3))
+    soon = await create_monitor(now + timedelta(days=5))
+    later = await create_monitor(now + timedelta(days=60))
+    for monitor in (sooner, soon, later):
+        update_monitor_timeline(monitor)
+
+    headers = {"Authorization": "Bearer token"}
+    # Disabled until its own token is set, whatever other tokens are
+    monkeypatch.setenv("CHANGE_FEED_TOKEN", "token")
+    response = await api.get("/api/monitors/expiring?days=30", headers=headers)
+    assert response.status_code == 401
+
+    monkeypatch.setenv("EXPIRING_API_TOKEN", "token")
+    response = await api.get("/api/monitors/expiring?days=30")
+    assert response.status_code == 401
+
+    response = await api.get(
+        "/api/monitors/expiring",
+        headers={"Authorization": "Bearer \xe9".encode("latin-1")},
+    )
+    assert response.status_code == 401
+
+    response = await api.get("/api/monitors/expiring?days=30", headers=headers)
+    assert response.status_code == 200
+    assert [monitor["uuid"] for monitor in response.json()] == [
+        str(sooner.uuid),
+        str(soon.uuid),
+    ]
+
+    response = await api.get(
+        "/api/monitors/expiring?days=30&limit=1&offset=1", headers=headers
+    )
+    assert [monitor["uuid"] for monitor in response.json()] == [str(soon.uuid)]
+
+    response = await api.get("/api/monitors/expiring?days=1000000000", headers=headers)
+    assert response.status_code == 422
+
+    response = await api.get("/api/monitors/expiring?limit=100000", headers=headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_apply_due_thresholds_unverified_certificate(db, redis, queue):
+    now = datetime.now(tz=timezone.utc)
+    expiring = await create_monitor(now + timedelta(days=6), state=MonitorState.ERROR)
+    expired = await create_monitor(now - timedelta(hours=1), state=MonitorState.ERROR)
+    redis.zadd(
+        THRESHOLD_KEY,
+        {
+            f"{expiring.uuid}:EXPIRING": (now - timedelta(days=1)).timestamp(),
+            f"{expired.uuid}:EXPIRED": (now - timedelta(hours=1)).timestamp(),
+        },
+    )
+
+    await apply_due_thresholds()
+
+    assert (
+        await CertificateMonitor.get(uuid=expiring.uuid)
+    ).state == MonitorState.ERROR
+    assert (
+        await CertificateMonitor.get(uuid=expired.uuid)
+    ).state == MonitorState.EXPIRED